@@ -4,12 +4,15 @@ from langchain.tools import tool
 from pydantic import BaseModel
 import discord
 from discord import app_commands
+from cachetools import TTLCache
 import os
 import io
 import json
+import re
 import asyncio
+import time
 from datetime import datetime, timedelta, timezone
-from typing import List, Tuple
+from typing import AsyncIterator, List, Tuple
 
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -64,34 +67,171 @@ def _parse_category_spec(guild: discord.Guild, spec: str) -> List[discord.Catego
                 out.append(ch)
 
     # Second pass: names (case-insensitive exact match)
+    name_index = client.category_name_map(guild)
     for p in parts:
         if p.isdigit():
             continue
-        for cat in guild.categories:
-            if cat.name.lower() == p.lower() and cat.id not in seen:
+        for cat in name_index.get(p.casefold(), ()):
+            if cat.id not in seen:
                 seen.add(cat.id)
                 out.append(cat)
 
     return out
 
+# discord.py's HTTP client already sleeps and retries 429s internally; these only
+# kick in once it gives up and raises
+HISTORY_MAX_RETRIES = 3
+HISTORY_BACKOFF_BASE = 1.0  # seconds; doubled on each retry
+
+
+def _retry_delay(error: discord.HTTPException, attempt: int) -> float:
+    """Seconds to wait before retrying after a 429: honor Retry-After, else back off exponentially."""
+    backoff = HISTORY_BACKOFF_BASE * (2 ** (attempt - 1))
+    retry_after = getattr(error, "retry_after", None)
+    response = getattr(error, "response", None)
+    if response is not None and response.headers.get("Retry-After"):
+        retry_after = response.headers["Retry-After"]
+    try:
+        return max(float(retry_after), backoff)
+    except (TypeError, ValueError):
+        return backoff
+
+
+async def _history_with_backoff(
+    channel: discord.abc.Messageable,
+    *,
+    max_retries: int = HISTORY_MAX_RETRIES,
+    **kwargs,
+) -> AsyncIterator[discord.Message]:
+    """
+    Same as `channel.history(**kwargs)`, but retries on 429.
+    Resumes after the last yielded message, so nothing is returned twice.
+    Other HTTP errors (and a 429 after `max_retries`) are re-raised.
+    """
+    limit = kwargs.get("limit", 100)
+    # discord.py defaults to oldest-first when `after` is given; pin it so resuming doesn't flip order
+    oldest_first = kwargs.get("oldest_first")
+    if oldest_first is None:
+        oldest_first = kwargs.get("after") is not None
+    kwargs["oldest_first"] = oldest_first
+
+    attempt = 0
+    yielded = 0
+    while True:
+        try:
+            async for msg in channel.history(**kwargs):
+                yielded += 1
+                # Move the resume point past this message
+                kwargs["after" if oldest_first else "before"] = msg
+                if limit is not None:
+                    kwargs["limit"] = limit - yielded
+                yield msg
+            return
+        except discord.HTTPException as e:
+            if e.status != 429 or attempt >= max_retries:
+                raise
+            attempt += 1
+            await asyncio.sleep(_retry_delay(e, attempt))
+            if limit is not None and yielded >= limit:
+                return
+
+
+PARALLEL_HISTORY_THRESHOLD = 200  # per-channel limits above this fetch the window in parallel slices
+HISTORY_SPLITS = 4
+
+
+async def _parallel_history(
+    channel: discord.abc.Messageable,
+    after: discord.abc.Snowflake,
+    before: discord.abc.Snowflake | None,
+    limit: int,
+    sem: asyncio.Semaphore,
+    n_splits: int = HISTORY_SPLITS,
+) -> AsyncIterator[discord.Message]:
+    """
+    Like `channel.history(after=after, before=before, limit=limit)` (oldest first),
+    but the window is cut into `n_splits` snowflake ranges that paginate concurrently.
+    Every slice fetch holds `sem`, the command's history-fetch semaphore.
+    `before=None` means "up to now".
+    """
+    lo = after.id
+    hi = before.id if before is not None else discord.utils.time_snowflake(datetime.now(timezone.utc))
+    step = max(1, (hi - lo) // n_splits)
+    bounds = [lo + i * step for i in range(n_splits)] + [hi]
+    # Each slice starts with an even share of `limit`, so the first pass costs about one
+    # serial fetch's worth of requests against the channel's shared rate-limit bucket
+    share = -(-limit // n_splits)
+
+    async def _fetch_slice(after_id: int, before_id: int | None, slice_limit: int) -> List[discord.Message]:
+        kwargs: dict = {"after": discord.Object(id=after_id), "limit": slice_limit, "oldest_first": True}
+        if before_id is not None:
+            kwargs["before"] = discord.Object(id=before_id)
+        async with sem:
+            return [msg async for msg in _history_with_backoff(channel, **kwargs)]
+
+    # Slice i covers ids in (bounds[i], bounds[i + 1]]; both `after` and `before` are
+    # exclusive. Slices are disjoint and ordered, so concatenating them keeps id order.
+    # The last one stops short of `hi` like `before=before` would, or is open-ended.
+    uppers: List[int | None] = [b + 1 for b in bounds[1:-1]]
+    uppers.append(None if before is None else hi)
+    tasks = [asyncio.create_task(_fetch_slice(a, b, share)) for a, b in zip(bounds, uppers)]
+    try:
+        remaining = limit
+        for before_id, task in zip(uppers, tasks):
+            msgs, asked = await task, share
+            while True:
+                for msg in msgs[:remaining]:
+                    yield msg
+                    remaining -= 1
+                if remaining <= 0:
+                    return
+                if len(msgs) < asked:
+                    break  # slice exhausted
+                # The slice filled its share and may hold more messages older than the
+                # next slice's: keep paging it (only now) before moving on
+                asked = remaining
+                msgs = await _fetch_slice(msgs[-1].id, before_id, asked)
+    finally:
+        # Earlier slices may already fill `limit`; don't keep paging the later ones
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 async def _search_channel_for_mentions(
     channel: discord.TextChannel,
     user: discord.User | discord.Member,
-    after_dt: datetime | None,
+    mention_re: re.Pattern[str],
+    after: discord.abc.Snowflake | None,
     per_channel_limit: int,
+    sem: asyncio.Semaphore,
 ) -> List[discord.Message]:
-    """Collect messages in `channel` where `user` was mentioned."""
+    """
+    Collect messages in `channel` where `user` was mentioned (`mention_re` matches their raw mention).
+    History fetches hold `sem`.
+    """
     hits: List[discord.Message] = []
     kwargs: dict = {"limit": per_channel_limit}
-    if after_dt:
-        kwargs["after"] = after_dt
+    if after is not None:
+        kwargs["after"] = after
 
-    try:
-        async for msg in channel.history(**kwargs):
-            if user in msg.mentions:
+    uid = user.id
+
+    async def _scan(history: AsyncIterator[discord.Message]) -> None:
+        async for msg in history:
+            # The payload's mentions are present even without the message_content intent
+            if any(m.id == uid for m in msg.mentions):
                 hits.append(msg)
-            elif f"<@{user.id}>" in msg.content or f"<@!{user.id}>" in msg.content:
+            elif msg.content and mention_re.search(msg.content):
                 hits.append(msg)
+
+    try:
+        if after is not None and per_channel_limit > PARALLEL_HISTORY_THRESHOLD:
+            # Each slice takes `sem` itself; holding it here too could deadlock
+            await _scan(_parallel_history(channel, after, None, per_channel_limit, sem))
+        else:
+            async with sem:
+                await _scan(_history_with_backoff(channel, **kwargs))
     except discord.Forbidden:
         pass
     except discord.HTTPException:
@@ -100,32 +240,195 @@ async def _search_channel_for_mentions(
     return hits
 
 
+MAX_THREADS_PER_CHANNEL = 20  # most recently active threads searched per channel
+
+
 async def _search_active_threads_for_mentions(
     channel: discord.TextChannel,
     user: discord.User | discord.Member,
-    after_dt: datetime | None,
+    mention_re: re.Pattern[str],
+    after: discord.abc.Snowflake | None,
     per_thread_limit: int,
+    sem: asyncio.Semaphore,
 ) -> List[Tuple[discord.Thread, List[discord.Message]]]:
-    """Search only active (unarchived) threads under a text channel."""
-    results: List[Tuple[discord.Thread, List[discord.Message]]] = []
-    for th in channel.threads:
-        if th.locked:
-            continue
+    """Search only active (unarchived) threads under a text channel; each thread fetch holds `sem`."""
+    uid = user.id
+    kwargs: dict = {"limit": per_thread_limit}
+    if after is not None:
+        kwargs["after"] = after
+
+    async def _fetch_thread(th: discord.Thread) -> List[discord.Message]:
+        th_hits: List[discord.Message] = []
         try:
-            th_hits: List[discord.Message] = []
-            kwargs: dict = {"limit": per_thread_limit}
-            if after_dt:
-                kwargs["after"] = after_dt
-            async for msg in th.history(**kwargs):
-                if user in msg.mentions or f"<@{user.id}>" in msg.content or f"<@!{user.id}>" in msg.content:
+            async for msg in _history_with_backoff(th, **kwargs):
+                if any(m.id == uid for m in msg.mentions):
+                    th_hits.append(msg)
+                elif msg.content and mention_re.search(msg.content):
                     th_hits.append(msg)
-            if th_hits:
-                results.append((th, th_hits))
         except (discord.Forbidden, discord.HTTPException):
-            continue
-    return results
+            return []
+        return th_hits
+
+    # Threads with no messages (or none since `after`) can't contain mentions; skip them before fetching anything
+    candidates = [
+        th
+        for th in channel.threads
+        if not th.locked
+        and th.last_message_id is not None
+        and (after is None or th.last_message_id > after.id)
+    ]
+    candidates.sort(key=lambda th: th.last_message_id, reverse=True)
+    candidates = candidates[:MAX_THREADS_PER_CHANNEL]
+
+    thread_hits = await asyncio.gather(*(_bounded(sem, _fetch_thread(th)) for th in candidates))
+    return [(th, hits) for th, hits in zip(candidates, thread_hits) if hits]
+
+
+SEARCH_CONCURRENCY = 8  # max in-flight history fetches per command
+MAX_LINES = 40  # to keep the embed readable; overflow goes to a file
+
+
+async def _bounded(sem: asyncio.Semaphore, coro):
+    """Await `coro` while holding `sem`."""
+    async with sem:
+        return await coro
     
 
+async def _collect_mentions(
+    target_categories: List[discord.CategoryChannel],
+    invoker: discord.User | discord.Member,
+    after: discord.abc.Snowflake | None,
+    per_channel_limit: int,
+    include_threads: bool,
+) -> Tuple[List[str], int]:
+    """Search `target_categories` for mentions of `invoker`; returns (summary lines, total hits)."""
+    mention_re = re.compile(rf"<@!?{invoker.id}>")
+    total_hits = 0
+    lines: List[str] = []
+
+    # Fan out the per-channel history fetches; they're I/O-bound, so run them
+    # concurrently (bounded so we don't trip Discord's rate limits)
+    sem = asyncio.Semaphore(SEARCH_CONCURRENCY)
+    targets = [(cat, ch) for cat in target_categories for ch in cat.text_channels]
+    tasks = [
+        asyncio.create_task(_search_channel_for_mentions(ch, invoker, mention_re, after, per_channel_limit, sem))
+        for _, ch in targets
+    ]
+    # Walk the results in category/channel order, counting the lines the formatter
+    # below will emit (threads only add more). Once that in-order prefix reaches
+    # MAX_LINES the output is truncated there, so only the channels after it get cancelled
+    cut = len(tasks)
+    prefix_lines = 0
+    last_cat_id = None
+    for i, ((cat, _), task) in enumerate(zip(targets, tasks)):
+        await asyncio.wait((task,))
+        if task.exception() is None and task.result():
+            prefix_lines += 1 + (cat.id != last_cat_id)
+            last_cat_id = cat.id
+            if prefix_lines >= MAX_LINES:
+                cut = i + 1
+                break
+    for t in tasks[cut:]:
+        t.cancel()
+    await asyncio.gather(*tasks[cut:], return_exceptions=True)
+
+    channel_hits = [
+        (cat, ch, t.result())
+        for (cat, ch), t in zip(targets[:cut], tasks[:cut])
+        if t.exception() is None and t.result()
+    ]
+
+    # Optional: Threads (only under channels that had hits)
+    thread_results: List[List[Tuple[discord.Thread, List[discord.Message]]]] = [[] for _ in channel_hits]
+    if include_threads and channel_hits:
+        # Like the channel searches, each thread fetch takes `sem` itself
+        thread_tasks = [
+            asyncio.create_task(
+                _search_active_threads_for_mentions(ch, invoker, mention_re, after, min(per_channel_limit, 100), sem)
+            )
+            for _, ch, _ in channel_hits
+        ]
+        thread_results = [
+            [] if isinstance(r, BaseException) else r
+            for r in await asyncio.gather(*thread_tasks, return_exceptions=True)
+        ]
+
+    # Format results (hot loop: bind globals/methods to locals once)
+    _max_lines = MAX_LINES
+    _append = lines.append
+    last_cat_id = None
+    for (cat, ch, hits), thread_hits in zip(channel_hits, thread_results):
+        total_hits += len(hits)
+        if cat.id != last_cat_id:
+            _append(f"**Category:** {cat.name} (`{cat.id}`)")
+            last_cat_id = cat.id
+        # Summarize per-channel with first few links
+        # Discord message jump URLs are perfect for navigation
+        sample_links = ", ".join(["[link](" + m.jump_url + ")" for m in hits[:3]])
+        suffix = " …" if len(hits) > 3 else ""
+        _append(f"• <#{ch.id}> — {len(hits)} mention(s): {sample_links}{suffix}")
+
+        for th, th_msgs in thread_hits:
+            total_hits += len(th_msgs)
+            sample_th_links = ", ".join(["[link](" + m.jump_url + ")" for m in th_msgs[:3]])
+            suffix_th = " …" if len(th_msgs) > 3 else ""
+            _append(f"   ↳ 🧵 <#{th.id}> — {len(th_msgs)} mention(s): {sample_th_links}{suffix_th}")
+
+        if len(lines) >= _max_lines:
+            _append("_Output truncated; see attachment for the full list._")
+            break
+
+    return lines, total_hits
+
+
+# Recent /find-collabs results: (guild id, user id) -> {command args: (stored at, result)}.
+# Keying the outer cache per user keeps lookups and invalidation O(1); each args entry
+# carries its own timestamp because re-setting the outer key restarts its TTL.
+COLLAB_CACHE_TTL = 60  # seconds
+_collab_cache: TTLCache = TTLCache(maxsize=512, ttl=COLLAB_CACHE_TTL)
+
+
+def _collab_cache_get(guild_id: int, user_id: int, args: tuple):
+    """Cached result for `args`, or None if missing or older than COLLAB_CACHE_TTL."""
+    entry = _collab_cache.get((guild_id, user_id))
+    if entry is None or args not in entry:
+        return None
+    stored_at, result = entry[args]
+    if time.monotonic() - stored_at >= COLLAB_CACHE_TTL:
+        del entry[args]
+        return None
+    return result
+
+
+def _collab_cache_put(guild_id: int, user_id: int, args: tuple, result) -> None:
+    now = time.monotonic()
+    entry = _collab_cache.get((guild_id, user_id)) or {}
+    # Drop expired siblings so a frequent user's entry doesn't accumulate them
+    entry = {a: v for a, v in entry.items() if now - v[0] < COLLAB_CACHE_TTL}
+    entry[args] = (now, result)
+    _collab_cache[(guild_id, user_id)] = entry
+
+
+def _invalidate_collab_cache(guild_id: int, user_ids: set[int]) -> None:
+    """Drop cached results for `user_ids` in a guild (they've just been mentioned again)."""
+    for user_id in user_ids:
+        _collab_cache.pop((guild_id, user_id), None)
+
+
+def _build_report(lines: List[str]) -> io.BytesIO:
+    """
+    UTF-8 text of `lines` for the overflow attachment.
+    Encodes line by line into one buffer instead of joining, then encoding, then copying.
+    """
+    buf = io.BytesIO()
+    write = buf.write
+    for line in lines:
+        write(line.encode("utf-8"))
+        write(b"\n")
+    buf.seek(0)
+    return buf
+
+
 EMBED_FIELD_LIMIT = 1024
 EMBED_MAX_FIELDS = 25  # absolute Discord limit
 
@@ -135,23 +438,28 @@ def chunk_lines_into_fields(lines, field_name_prefix="Summary"):
     Returns a list of (name, value) pairs ready for embed.add_field.
     """
     fields = []
-    buf = []
+    # locals for the loop below
+    limit = EMBED_FIELD_LIMIT
+    _append = fields.append
+    buf = io.StringIO()
     buf_len = 0
     for line in lines:
         line = line.strip()
         if not line:
             continue
-        # +1 for the newline that will be inserted on join
-        add_len = len(line) + (1 if buf else 0)
-        if buf_len + add_len > EMBED_FIELD_LIMIT:
-            fields.append((f"{field_name_prefix} {len(fields)+1}", "\n".join(buf)))
-            buf = [line]
-            buf_len = len(line)
+        line_len = len(line)
+        # +1 for the newline separating it from the previous line
+        add_len = line_len + (1 if buf_len else 0)
+        if buf_len + add_len > limit:
+            _append((f"{field_name_prefix} {len(fields)+1}", buf.getvalue()))
+            buf = io.StringIO()
+            buf.write(line)
+            buf_len = line_len
         else:
-            buf.append(line)
+            buf.write("\n" + line if buf_len else line)
             buf_len += add_len
-    if buf:
-        fields.append((f"{field_name_prefix} {len(fields)+1}", "\n".join(buf)))
+    if buf_len:
+        _append((f"{field_name_prefix} {len(fields)+1}", buf.getvalue()))
     return fields
 
 
@@ -159,10 +467,54 @@ class AgentClient(discord.Client):
     def __init__(self):
         super().__init__(intents=intents)
         self.tree = app_commands.CommandTree(self)
+        # guild id -> {casefolded category name: categories with that name}
+        self._cat_name_maps: dict[int, dict[str, List[discord.CategoryChannel]]] = {}
 
     async def setup_hook(self):
         await self.tree.sync()
 
+    def category_name_map(self, guild: discord.Guild) -> dict[str, List[discord.CategoryChannel]]:
+        """Casefolded name -> categories for `guild`; built on first use and kept fresh by the channel events."""
+        name_map = self._cat_name_maps.get(guild.id)
+        if name_map is None:
+            name_map = self._rebuild_category_name_map(guild)
+        return name_map
+
+    def _rebuild_category_name_map(self, guild: discord.Guild) -> dict[str, List[discord.CategoryChannel]]:
+        # Category names aren't unique, so keep every match
+        name_map: dict[str, List[discord.CategoryChannel]] = {}
+        for c in guild.categories:
+            name_map.setdefault(c.name.casefold(), []).append(c)
+        self._cat_name_maps[guild.id] = name_map
+        return name_map
+
+    async def on_ready(self):
+        for guild in self.guilds:
+            self._rebuild_category_name_map(guild)
+
+    async def on_guild_join(self, guild: discord.Guild):
+        self._rebuild_category_name_map(guild)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self._cat_name_maps.pop(guild.id, None)
+
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        if isinstance(channel, discord.CategoryChannel):
+            self._rebuild_category_name_map(channel.guild)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        if isinstance(channel, discord.CategoryChannel):
+            self._rebuild_category_name_map(channel.guild)
+
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        if isinstance(after, discord.CategoryChannel) and before.name != after.name:
+            self._rebuild_category_name_map(after.guild)
+
+    async def on_message(self, message: discord.Message):
+        # New mentions make cached /find-collabs results stale
+        if message.guild is not None and message.mentions:
+            _invalidate_collab_cache(message.guild.id, {u.id for u in message.mentions})
+
 client = AgentClient()
 
 
@@ -187,61 +539,35 @@ async def find_collabs(
         await interaction.followup.send("This command must be used in a server.", ephemeral=True)
         return
 
-    # Resolve categories
-    if categories.strip():
-        target_categories = _parse_category_spec(guild, categories)
-        if not target_categories:
-            await interaction.followup.send(
-                "I couldn't match any categories from your input. "
-                "Provide comma-separated category names or IDs.",
-                ephemeral=True,
-            )
-            return
+    invoker = interaction.user
+    cache_args = (categories, days, per_channel_limit, include_threads)
+    cached = _collab_cache_get(guild.id, invoker.id, cache_args)
+    if cached is not None:
+        lines, total_hits = cached
     else:
-        target_categories = list(guild.categories)
+        # Resolve categories
+        if categories.strip():
+            target_categories = _parse_category_spec(guild, categories)
+            if not target_categories:
+                await interaction.followup.send(
+                    "I couldn't match any categories from your input. "
+                    "Provide comma-separated category names or IDs.",
+                    ephemeral=True,
+                )
+                return
+        else:
+            target_categories = list(guild.categories)
 
-    # Time window
-    after_dt = datetime.now(timezone.utc) - timedelta(days=max(0, days))
+        # Time window
+        after_dt = datetime.now(timezone.utc) - timedelta(days=max(0, days))
+        # Convert to a snowflake once instead of letting every history() call redo it
+        # (high=True matches how discord.py converts an `after` datetime)
+        after = discord.Object(id=discord.utils.time_snowflake(after_dt, high=True))
 
-    # Collect results
-    invoker = interaction.user
-    total_hits = 0
-    lines: List[str] = []
-    MAX_LINES = 40  # to keep the embed readable; overflow goes to a file
-
-    for cat in target_categories:
-        cat_header_added = False
-
-        # Search text channels in this category
-        for ch in cat.text_channels:
-            hits = await _search_channel_for_mentions(ch, invoker, after_dt, per_channel_limit)
-            if hits:
-                total_hits += len(hits)
-                if not cat_header_added:
-                    lines.append(f"**Category:** {cat.name} (`{cat.id}`)")
-                    cat_header_added = True
-                # Summarize per-channel with first few links
-                # Discord message jump URLs are perfect for navigation
-                sample = hits[:3]
-                sample_links = ", ".join(f"[link]({m.jump_url})" for m in sample)
-                lines.append(f"• <#{ch.id}> — {len(hits)} mention(s): {sample_links}{' …' if len(hits) > 3 else ''}")
-
-                # Optional: Threads
-                if include_threads:
-                    thread_hits = await _search_active_threads_for_mentions(ch, invoker, after_dt, min(per_channel_limit, 100))
-                    for th, th_msgs in thread_hits:
-                        total_hits += len(th_msgs)
-                        sample_th = th_msgs[:3]
-                        sample_th_links = ", ".join(f"[link]({m.jump_url})" for m in sample_th)
-                        lines.append(
-                            f"   ↳ 🧵 <#{th.id}> — {len(th_msgs)} mention(s): {sample_th_links}{' …' if len(th_msgs) > 3 else ''}"
-                        )
-
-                if len(lines) >= MAX_LINES:
-                    lines.append("_Output truncated; see attachment for the full list._")
-                    break
-        if len(lines) >= MAX_LINES:
-            break
+        lines, total_hits = await _collect_mentions(
+            target_categories, invoker, after, per_channel_limit, include_threads
+        )
+        _collab_cache_put(guild.id, invoker.id, cache_args, (lines, total_hits))
 
     if total_hits == 0:
         await interaction.followup.send("No pings found for you in the selected categories and time window.", ephemeral=True)
@@ -257,8 +583,7 @@ async def find_collabs(
 
     if len(fields) >= EMBED_MAX_FIELDS:
         # Too many fields; attach full text and keep the first few fields
-        full_text = "\n".join(lines)
-        file_obj = discord.File(io.BytesIO(full_text.encode("utf-8")), filename="mentions_report.txt")
+        file_obj = discord.File(_build_report(lines), filename="mentions_report.txt")
 
         # Leave room for other fields if you add more later; keep e.g. first 10
         kept = min(10, EMBED_MAX_FIELDS - 1)